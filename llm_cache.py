@@ -0,0 +1,125 @@
+# -*- coding: utf-8 -*-
+"""
+llm_cache.py  —  In-process caches for OpenAI chat calls:
+- LLMCache: exact-match LRU + TTL, keyed by a sha256 of the request
+- SemanticCache: embedding lookup (cosine >= threshold) for free-text prompts
+- cached_chat: drop-in wrapper around client.chat.completions.create
+"""
+
+import hashlib, json, threading, time
+from collections import OrderedDict
+from typing import Any, Callable, List, Optional, Sequence
+
+import numpy as np
+
+
+def cache_key(model: str, messages: Sequence[Any], temperature: Optional[float], tools: Any = None, **extra) -> str:
+    payload = {"model": model, "messages": messages, "temperature": temperature, "tools": tools, **extra}
+    return hashlib.sha256(json.dumps(payload, sort_keys=True, default=str).encode("utf-8")).hexdigest()
+
+
+class LLMCache:
+    """Thread-safe LRU cache whose entries expire after `ttl` seconds."""
+
+    def __init__(self, maxsize: int = 1024, ttl: float = 3600.0):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data: "OrderedDict[str, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[Any]:
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return None
+            expires, value = item
+            if expires < time.monotonic():
+                del self._data[key]
+                return None
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key: str, value: Any) -> None:
+        with self._lock:
+            self._data[key] = (time.monotonic() + self.ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+
+
+class SemanticCache:
+    """
+    Cache keyed by text similarity. Entries live in a namespace (e.g. the non-text
+    inputs of a prompt) and match when their embedding's cosine similarity to the
+    query is >= threshold. Brute-force inner product over a small matrix.
+    """
+
+    def __init__(self, embed_fn: Callable[[str], List[float]], threshold: float = 0.92,
+                 ttl: float = 3600.0, maxsize: int = 512):
+        self.embed_fn = embed_fn
+        self.threshold = threshold
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self._entries: List[tuple] = []  # (expires, namespace, unit vector, value)
+        self._lock = threading.Lock()
+
+    def _embed(self, text: str) -> np.ndarray:
+        vec = np.asarray(self.embed_fn(text), dtype=np.float32)
+        norm = np.linalg.norm(vec)
+        return vec / norm if norm else vec
+
+    def _lookup(self, vec: np.ndarray, namespace: str) -> Optional[Any]:
+        now = time.monotonic()
+        with self._lock:
+            self._entries = [e for e in self._entries if e[0] >= now]
+            candidates = [e for e in self._entries if e[1] == namespace]
+            if not candidates:
+                return None
+            scores = np.stack([e[2] for e in candidates]) @ vec
+            best = int(scores.argmax())
+            return candidates[best][3] if scores[best] >= self.threshold else None
+
+    def _store(self, vec: np.ndarray, value: Any, namespace: str) -> None:
+        with self._lock:
+            self._entries.append((time.monotonic() + self.ttl, namespace, vec, value))
+            if len(self._entries) > self.maxsize:
+                del self._entries[: len(self._entries) - self.maxsize]
+
+    def get_or_compute(self, text: str, compute: Callable[[], Any], namespace: str = "") -> Any:
+        """Return a cached value for a similar text, else compute() and cache it."""
+        try:
+            vec = self._embed(text)
+        except Exception as e:
+            print("Semantic cache embedding error:", e)
+            return compute()
+        hit = self._lookup(vec, namespace)
+        if hit is not None:
+            return hit
+        value = compute()
+        self._store(vec, value, namespace)
+        return value
+
+
+def cached_chat(client, cache: LLMCache, *, cache_nondeterministic: bool = False, limiter=None, **kwargs):
+    """
+    client.chat.completions.create(**kwargs) with an exact-match cache.
+    Only temperature=0 requests are cached unless cache_nondeterministic=True.
+    limiter (e.g. rate_limit.ModelLimiter) is acquired only for requests that go to the API.
+    """
+    if kwargs.get("temperature", 1) != 0 and not cache_nondeterministic:
+        if limiter is not None:
+            limiter.acquire(**kwargs)
+        return client.chat.completions.create(**kwargs)
+    key = cache_key(**kwargs)
+    hit = cache.get(key)
+    if hit is not None:
+        return hit
+    if limiter is not None:
+        limiter.acquire(**kwargs)
+    resp = client.chat.completions.create(**kwargs)
+    cache.set(key, resp)
+    return resp
@@ -1,8 +1,11 @@
 import os
 import json
 import base64
+import orjson
 import asyncio
+from collections import deque
 import websockets
+from websockets.protocol import State
 from fastapi import FastAPI, WebSocket, Request
 from fastapi.responses import HTMLResponse, JSONResponse
 from fastapi.websockets import WebSocketDisconnect
@@ -53,6 +56,17 @@ PORT = int(os.getenv("PORT", 5050))
 TEMPERATURE = float(os.getenv("TEMPERATURE", 0.8))
 VOICE = "verse"
 SHOW_TIMING_MATH = False
+# Full event/session payload logging; off by default since it serializes kilobytes per call
+DEBUG = os.getenv("DEBUG", "").strip().lower() in {"1", "true", "yes", "on"}
+# Outbound audio is coalesced into frames of at least this many ms (8 kHz u-law = 8 bytes/ms)
+AUDIO_BATCH_MS = int(os.getenv("AUDIO_BATCH_MS", 80))
+AUDIO_BATCH_BYTES = AUDIO_BATCH_MS * 8
+# Websocket buffer limits. Twilio frames are tiny; OpenAI frames (audio deltas,
+# response.done with transcripts) get more headroom since oversize frames drop the call.
+TWILIO_WS_MAX_SIZE = 64 * 1024
+OPENAI_WS_MAX_SIZE = 256 * 1024
+WS_MAX_QUEUE = 16
+WS_WRITE_LIMIT = 64 * 1024
 LOG_EVENT_TYPES = [
     "error",
     "response.content.done",
@@ -64,6 +78,12 @@ LOG_EVENT_TYPES = [
     "session.created",
     "session.updated",
 ]
+_WS_OPEN = State.OPEN
+# OpenAI events send_to_twilio acts on or logs; anything else is skipped unparsed
+_HANDLED_EVENT_TYPES = frozenset(LOG_EVENT_TYPES) | {
+    "response.output_audio.delta",
+    "response.output_audio.done",
+}
 
 # -----------------------------
 # OB/GYN Subspecialties
@@ -114,6 +134,29 @@ After collecting information, provide:
 Keep your tone warm, professional, and reassuring. Speak clearly and avoid medical jargon when possible.
 """
 
+# -----------------------------
+# Twilio media frame template
+# -----------------------------
+# Outbound media frames only differ in streamSid and payload, so build the JSON
+# text around the payload once per stream instead of serializing a dict per frame.
+_MEDIA_FRAME_SUFFIX = '"}}'
+
+def _media_frame_prefix(stream_sid):
+    return '{"event":"media","streamSid":' + orjson.dumps(stream_sid).decode() + ',"media":{"payload":"'
+
+_EVENT_TYPE_PREFIX = '{"type":"'
+
+def _peek_event_type(message):
+    """
+    Top-level "type" of an OpenAI event when the frame starts with it; None otherwise
+    (the caller then parses the whole frame, so nested "type" keys can't be mistaken for it).
+    """
+    if not isinstance(message, str) or not message.startswith(_EVENT_TYPE_PREFIX):
+        return None
+    start = len(_EVENT_TYPE_PREFIX)
+    end = message.find('"', start)
+    return message[start:end] if end > 0 else None
+
 # -----------------------------
 # FastAPI App
 # -----------------------------
@@ -154,7 +197,13 @@ async def handle_media_stream(websocket: WebSocket):
         f"wss://api.openai.com/v1/realtime?model=gpt-realtime&temperature={TEMPERATURE}",
         additional_headers={
             "Authorization": f"Bearer {OPENAI_API_KEY}"
-        }
+        },
+        # u-law audio doesn't compress; skip per-frame zlib work
+        compression=None,
+        # Bound per-call buffering so each concurrent call has a fixed memory ceiling
+        max_size=OPENAI_WS_MAX_SIZE,
+        max_queue=WS_MAX_QUEUE,
+        write_limit=WS_WRITE_LIMIT,
     ) as openai_ws:
         await initialize_session(openai_ws)
 
@@ -162,35 +211,42 @@ async def handle_media_stream(websocket: WebSocket):
         stream_sid = None
         latest_media_timestamp = 0
         last_assistant_item = None
-        mark_queue = []
+        mark_queue = deque()
         response_start_timestamp_twilio = None
+        media_frame_prefix = _media_frame_prefix(stream_sid)
+        audio_buffer = bytearray()
 
         async def receive_from_twilio():
             """Receive audio data from Twilio and send it to the OpenAI Realtime API."""
-            nonlocal stream_sid, latest_media_timestamp
+            nonlocal stream_sid, latest_media_timestamp, media_frame_prefix
+            nonlocal response_start_timestamp_twilio, last_assistant_item
             try:
-                async for message in websocket.iter_text():
-                    data = json.loads(message)
-                    if data.get('event') == 'media' and openai_ws.state.name == 'OPEN':
+                while True:
+                    # Raw ASGI receive: orjson parses bytes or str directly, no receive_text() wrapper
+                    message = await websocket.receive()
+                    if message["type"] == "websocket.disconnect":
+                        raise WebSocketDisconnect(message.get("code", 1000))
+                    data = orjson.loads(message.get("bytes") or message["text"])
+                    if data.get('event') == 'media' and openai_ws.state is _WS_OPEN:
                         latest_media_timestamp = int(data['media']['timestamp'])
                         audio_append = {
                             "type": "input_audio_buffer.append",
                             "audio": data['media']['payload']
                         }
-                        await openai_ws.send(json.dumps(audio_append))
+                        await openai_ws.send(orjson.dumps(audio_append), text=True)
                     elif data.get('event') == 'start':
                         stream_sid = data['start']['streamSid']
+                        media_frame_prefix = _media_frame_prefix(stream_sid)
                         print(f"Incoming stream has started {stream_sid}")
-                        nonlocal_vars = None
                         response_start_timestamp_twilio = None
                         latest_media_timestamp = 0
                         last_assistant_item = None
                     elif data.get('event') == 'mark':
                         if mark_queue:
-                            mark_queue.pop(0)
+                            mark_queue.popleft()
             except WebSocketDisconnect:
                 print("Client disconnected.")
-                if openai_ws.state.name == 'OPEN':
+                if openai_ws.state is _WS_OPEN:
                     await openai_ws.close()
             except Exception as e:
                 print(f"Error in receive_from_twilio: {e}")
@@ -199,6 +255,8 @@ async def handle_media_stream(websocket: WebSocket):
             """Handle interruption when the caller's speech starts."""
             nonlocal response_start_timestamp_twilio, last_assistant_item
             print("Handling speech started event.")
+            # Audio still buffered here was never played, so just drop it
+            audio_buffer.clear()
             if mark_queue and response_start_timestamp_twilio is not None:
                 elapsed_time = latest_media_timestamp - response_start_timestamp_twilio
                 if SHOW_TIMING_MATH:
@@ -214,11 +272,11 @@ async def handle_media_stream(websocket: WebSocket):
                         "content_index": 0,
                         "audio_end_ms": elapsed_time
                     }
-                    await openai_ws.send(json.dumps(truncate_event))
+                    await openai_ws.send(orjson.dumps(truncate_event), text=True)
 
-                await websocket.send_json({
-                    "event": "clear",
-                    "streamSid": stream_sid
+                await websocket.send({
+                    "type": "websocket.send",
+                    "text": orjson.dumps({"event": "clear", "streamSid": stream_sid}).decode(),
                 })
 
                 mark_queue.clear()
@@ -232,28 +290,39 @@ async def handle_media_stream(websocket: WebSocket):
                     "streamSid": stream_sid,
                     "mark": {"name": "responsePart"}
                 }
-                await connection.send_json(mark_event)
+                await connection.send({"type": "websocket.send", "text": orjson.dumps(mark_event).decode()})
                 mark_queue.append('responsePart')
 
+        async def flush_audio():
+            """Send buffered assistant audio to Twilio as one media frame plus one mark."""
+            if not audio_buffer:
+                return
+            # base64 needs no JSON escaping, so splice it into the preformatted frame
+            audio_payload = base64.b64encode(audio_buffer).decode('ascii')
+            audio_buffer.clear()
+            # Raw ASGI send: the frame is already JSON text, skip the send_text()/send_json() layer
+            await websocket.send({"type": "websocket.send", "text": media_frame_prefix + audio_payload + _MEDIA_FRAME_SUFFIX})
+            await send_mark(websocket, stream_sid)
+
         async def send_to_twilio():
             """Receive events from the OpenAI Realtime API, send audio back to Twilio."""
             nonlocal stream_sid, last_assistant_item, response_start_timestamp_twilio
             try:
                 async for openai_message in openai_ws:
-                    response = json.loads(openai_message)
+                    # Transcript deltas and other chatter outnumber what we use; skip them before parsing
+                    event_type = _peek_event_type(openai_message)
+                    if event_type is not None and event_type not in _HANDLED_EVENT_TYPES:
+                        continue
+                    response = orjson.loads(openai_message)
                     if response.get('type') in LOG_EVENT_TYPES:
-                        print(f"Received event: {response.get('type')}", response)
+                        if DEBUG or response.get('type') == 'error':
+                            print(f"Received event: {response.get('type')}", response)
+                        else:
+                            print(f"Received event: {response.get('type')}")
 
                     if response.get('type') == 'response.output_audio.delta' and 'delta' in response:
-                        audio_payload = base64.b64encode(base64.b64decode(response['delta'])).decode('utf-8')
-                        audio_delta = {
-                            "event": "media",
-                            "streamSid": stream_sid,
-                            "media": {
-                                "payload": audio_payload
-                            }
-                        }
-                        await websocket.send_json(audio_delta)
+                        # Base64 chunks can't be concatenated as text (padding), so buffer raw u-law
+                        audio_buffer.extend(base64.b64decode(response['delta']))
 
                         if response.get("item_id") and response["item_id"] != last_assistant_item:
                             response_start_timestamp_twilio = latest_media_timestamp
@@ -261,7 +330,11 @@ async def handle_media_stream(websocket: WebSocket):
                             if SHOW_TIMING_MATH:
                                 print(f"Setting start timestamp for new response: {response_start_timestamp_twilio}ms")
 
-                        await send_mark(websocket, stream_sid)
+                        if len(audio_buffer) >= AUDIO_BATCH_BYTES:
+                            await flush_audio()
+
+                    if response.get('type') in ('response.output_audio.done', 'response.done'):
+                        await flush_audio()
 
                     if response.get('type') == 'input_audio_buffer.speech_started':
                         print("Speech started detected.")
@@ -271,45 +344,59 @@ async def handle_media_stream(websocket: WebSocket):
             except Exception as e:
                 print(f"Error in send_to_twilio: {e}")
 
-        await asyncio.gather(receive_from_twilio(), send_to_twilio())
+        # Either side finishing means the call is over, so cancel its peer; leaving the
+        # `async with` then closes the OpenAI socket right away instead of on GC
+        async with asyncio.TaskGroup() as tg:
+            twilio_task = tg.create_task(receive_from_twilio())
+            openai_task = tg.create_task(send_to_twilio())
+            twilio_task.add_done_callback(lambda _: openai_task.cancel())
+            openai_task.add_done_callback(lambda _: twilio_task.cancel())
 
 # -----------------------------
 # Helper functions for OpenAI session
 # -----------------------------
-async def send_initial_conversation_item(openai_ws):
-    initial_conversation_item = {
-        "type": "conversation.item.create",
-        "item": {
-            "type": "message",
-            "role": "user",
-            "content": [
-                {
-                    "type": "input_text",
-                    "text": "Greet the user with 'Hello there! I am an AI voice assistant powered by Twilio and the OpenAI Realtime API. You can ask me for facts, jokes, or anything you can imagine. How can I help you?'"
-                }
-            ]
-        }
+# Session frames never change between calls, so serialize them once at import
+SESSION_UPDATE = {
+    "type": "session.update",
+    "session": {
+        "type": "realtime",
+        "model": "gpt-realtime",
+        "output_modalities": ["audio"],
+        "audio": {
+            "input": {"format": {"type": "audio/pcmu"}, "turn_detection": {"type": "server_vad"}},
+            "output": {"format": {"type": "audio/pcmu"}, "voice": VOICE}
+        },
+        "instructions": SYSTEM_MESSAGE,
     }
-    await openai_ws.send(json.dumps(initial_conversation_item))
-    await openai_ws.send(json.dumps({"type": "response.create"}))
+}
+INITIAL_CONVERSATION_ITEM = {
+    "type": "conversation.item.create",
+    "item": {
+        "type": "message",
+        "role": "user",
+        "content": [
+            {
+                "type": "input_text",
+                "text": "Greet the user with 'Hello there! I am an AI voice assistant powered by Twilio and the OpenAI Realtime API. You can ask me for facts, jokes, or anything you can imagine. How can I help you?'"
+            }
+        ]
+    }
+}
+_SESSION_UPDATE_BYTES = orjson.dumps(SESSION_UPDATE)
+_INITIAL_CONVERSATION_ITEM_BYTES = orjson.dumps(INITIAL_CONVERSATION_ITEM)
+_RESPONSE_CREATE_BYTES = orjson.dumps({"type": "response.create"})
+
+async def send_initial_conversation_item(openai_ws):
+    await openai_ws.send(_INITIAL_CONVERSATION_ITEM_BYTES, text=True)
+    await openai_ws.send(_RESPONSE_CREATE_BYTES, text=True)
 
 async def initialize_session(openai_ws):
     """Control initial session with OpenAI."""
-    session_update = {
-        "type": "session.update",
-        "session": {
-            "type": "realtime",
-            "model": "gpt-realtime",
-            "output_modalities": ["audio"],
-            "audio": {
-                "input": {"format": {"type": "audio/pcmu"}, "turn_detection": {"type": "server_vad"}},
-                "output": {"format": {"type": "audio/pcmu"}, "voice": VOICE}
-            },
-            "instructions": SYSTEM_MESSAGE,
-        }
-    }
-    print("Sending session update:", json.dumps(session_update))
-    await openai_ws.send(json.dumps(session_update))
+    if DEBUG:
+        print("Sending session update:", _SESSION_UPDATE_BYTES.decode())
+    else:
+        print("Sending session update")
+    await openai_ws.send(_SESSION_UPDATE_BYTES, text=True)
     # Uncomment the next line to have the AI speak first
     # await send_initial_conversation_item(openai_ws)
 
@@ -318,4 +405,22 @@ async def initialize_session(openai_ws):
 # -----------------------------
 if __name__ == "__main__":
     import uvicorn
-    uvicorn.run(app, host="0.0.0.0", port=PORT)
+
+    # Prefer uvloop/httptools for the media relay; fall back to stock asyncio if unavailable
+    try:
+        import uvloop  # noqa: F401  (uvicorn sets up the loop itself via loop="uvloop")
+        _LOOP = "uvloop"
+    except ImportError:
+        _LOOP = "asyncio"
+    try:
+        import httptools  # noqa: F401
+        _HTTP = "httptools"
+    except ImportError:
+        _HTTP = "h11"
+
+    uvicorn.run(
+        app, host="0.0.0.0", port=PORT, loop=_LOOP, http=_HTTP, ws="websockets",
+        ws_per_message_deflate=False,
+        ws_max_size=TWILIO_WS_MAX_SIZE, ws_max_queue=WS_MAX_QUEUE,
+        ws_ping_interval=20.0, ws_ping_timeout=20.0,
+    )
@@ -0,0 +1,120 @@
+# -*- coding: utf-8 -*-
+"""
+rate_limit.py  —  Client-side throttling for OpenAI chat calls:
+- TokenBucket: requests-per-minute + tokens-per-minute bucket; callers wait
+  *before* sending, so bursts queue locally instead of coming back as 429s
+- estimate_tokens: prompt + completion estimate (tiktoken when installed)
+- ModelLimiter: one TokenBucket per model (OpenAI limits are per model)
+"""
+
+import asyncio, json, threading, time
+from functools import lru_cache
+from typing import Any, Dict, Optional, Sequence
+
+try:
+    import tiktoken
+except ImportError:
+    tiktoken = None
+
+
+class TokenBucket:
+    """Continuously refilling RPM and TPM buckets, shared by threads and coroutines."""
+
+    def __init__(self, rpm: float, tpm: float):
+        self.rpm = rpm
+        self.tpm = tpm
+        self._requests = float(rpm)
+        self._tokens = float(tpm)
+        self._last = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _reserve(self, tokens: int) -> float:
+        """Take capacity and return 0, or return how many seconds to wait before retrying."""
+        tokens = min(tokens, self.tpm)  # an oversized request still goes through once the bucket is full
+        with self._lock:
+            now = time.monotonic()
+            elapsed = now - self._last
+            self._last = now
+            self._requests = min(self.rpm, self._requests + elapsed * self.rpm / 60.0)
+            self._tokens = min(self.tpm, self._tokens + elapsed * self.tpm / 60.0)
+            if self._requests >= 1 and self._tokens >= tokens:
+                self._requests -= 1
+                self._tokens -= tokens
+                return 0.0
+            wait_requests = max(0.0, 1 - self._requests) * 60.0 / self.rpm
+            wait_tokens = max(0.0, tokens - self._tokens) * 60.0 / self.tpm
+            return max(wait_requests, wait_tokens)
+
+    def acquire(self, tokens: int = 1) -> None:
+        while True:
+            wait = self._reserve(tokens)
+            if not wait:
+                return
+            time.sleep(wait)
+
+    async def aacquire(self, tokens: int = 1) -> None:
+        while True:
+            wait = self._reserve(tokens)
+            if not wait:
+                return
+            await asyncio.sleep(wait)
+
+
+@lru_cache(maxsize=16)
+def _encoding(model: str):
+    """tiktoken encoding for model, or None (cached too) when it can't be loaded, e.g. BPE download fails."""
+    if tiktoken is None:
+        return None
+    try:
+        try:
+            return tiktoken.encoding_for_model(model)
+        except KeyError:
+            return tiktoken.get_encoding("o200k_base")
+    except Exception as e:
+        print("⚠️ tiktoken unavailable, estimating tokens from length:", e)
+        return None
+
+
+def estimate_tokens(model: str, messages: Sequence[Dict[str, Any]], tools: Any = None,
+                    completion_tokens: int = 256) -> int:
+    """Rough request size: message text (+ tool schemas) plus an allowance for the completion."""
+    text = "".join(str(m.get("content") or "") for m in messages)
+    if tools:
+        text += json.dumps(tools)
+    enc = _encoding(model)
+    prompt = len(text) // 4
+    if enc is not None:
+        try:
+            prompt = len(enc.encode(text, disallowed_special=()))
+        except Exception:
+            pass  # the estimate is a heuristic; never block the request on it
+    # ~4 tokens of chat framing per message
+    return prompt + 4 * len(messages) + completion_tokens
+
+
+class ModelLimiter:
+    """TokenBucket per model; acquire() takes the same kwargs as chat.completions.create."""
+
+    def __init__(self, rpm: float, tpm: float, limits: Optional[Dict[str, tuple]] = None):
+        self.rpm = rpm
+        self.tpm = tpm
+        self.limits = dict(limits or {})  # model -> (rpm, tpm) overrides
+        self._buckets: Dict[str, TokenBucket] = {}
+        self._lock = threading.Lock()
+
+    def bucket(self, model: str) -> TokenBucket:
+        with self._lock:
+            b = self._buckets.get(model)
+            if b is None:
+                b = self._buckets[model] = TokenBucket(*self.limits.get(model, (self.rpm, self.tpm)))
+            return b
+
+    def _cost(self, request: Dict[str, Any]) -> int:
+        return estimate_tokens(request["model"], request.get("messages", ()), request.get("tools"),
+                               request.get("max_tokens") or 256)
+
+    def acquire(self, **request) -> None:
+        self.bucket(request["model"]).acquire(self._cost(request))
+
+    async def aacquire(self, **request) -> None:
+        await self.bucket(request["model"]).aacquire(self._cost(request))
@@ -1,22 +1,23 @@
 import pandas as pd
 from typing import Dict, List, Any, Optional
 
-WEEKDAYS = ["Mon","Tue","Wed","Thu","Fri","Sat","Sun"]
+WEEKDAYS = frozenset({"Mon","Tue","Wed","Thu","Fri","Sat","Sun"})
+TRUTHY_VALUES = ["1","y","yes","true","available","avail","ok","✓"]
+FALSY_VALUES = ["0","n","no","false","","na","nan"]
 
 def normalize_columns(df: pd.DataFrame) -> pd.DataFrame:
     cols = {c:str(c).strip() for c in df.columns}
     df = df.rename(columns=cols)
-    has_wide_days = any(c[:3] in WEEKDAYS for c in df.columns)
-    if has_wide_days:
-        day_cols = [c for c in df.columns if str(c)[:3] in WEEKDAYS]
-        key_cols = [c for c in df.columns if c not in day_cols]
+    day_mask = df.columns.astype(str).str[:3].isin(WEEKDAYS)
+    if day_mask.any():
+        day_cols = df.columns[day_mask].tolist()
+        key_cols = df.columns[~day_mask].tolist()
         long = df[key_cols + day_cols].melt(id_vars=key_cols, value_vars=day_cols, var_name="Day", value_name="Value")
         long["Day"] = long["Day"].astype(str).str[:3]
-        def to_bool(x):
-            if pd.isna(x): return False
-            s = str(x).strip().lower()
-            return s in {"1","y","yes","true","available","avail","ok","✓"} or len(s) > 0 and s not in {"0","n","no","false","","na","nan"}
-        long["Available"] = long["Value"].apply(to_bool)
+        s = long["Value"].astype(str).str.strip().str.lower()
+        long["Available"] = long["Value"].notna() & (
+            s.isin(TRUTHY_VALUES) | (s.ne("") & ~s.isin(FALSY_VALUES))
+        )
         if "Doctor" not in long.columns:
             for k in ["Provider","Physician","MD","Name"]:
                 if k in long.columns:
@@ -43,112 +44,116 @@ def normalize_columns(df: pd.DataFrame) -> pd.DataFrame:
     raise ValueError("Unrecognized schedule format.")
 
 
+_DEFAULT_DOCTORS: Dict[str, Any] = {
+    "doctors": [
+        {
+            "name": "Dr. Alice Smith",
+            "subspecialties": ["general_obgyn", "maternal_fetal"],
+            "insurances": ["aetna", "uhc", "bcbs"],
+            "schedule": {
+                "Mon": ["09:00", "10:00", "14:00", "15:00"],
+                "Tue": ["09:00", "10:00", "11:00"],
+                "Thu": ["09:00", "14:00", "15:00", "16:00"]
+            }
+        },
+        {
+            "name": "Dr. Brian Lee",
+            "subspecialties": ["general_obgyn", "minimally_invasive"],
+            "insurances": ["aetna", "cigna"],
+            "schedule": {
+                "Tue": ["10:00", "11:00", "14:00"],
+                "Wed": ["09:00", "10:00", "14:00", "15:00"],
+                "Fri": ["09:00", "10:00", "11:00"]
+            }
+        },
+        {
+            "name": "Dr. Carol Chen",
+            "subspecialties": ["general_obgyn", "urogynecology"],
+            "insurances": ["aetna", "uhc", "medicare"],
+            "schedule": {
+                "Mon": ["10:00", "11:00", "15:00"],
+                "Wed": ["09:00", "14:00", "15:00", "16:00"],
+                "Fri": ["09:00", "10:00", "14:00"]
+            }
+        },
+        {
+            "name": "Dr. David Patel",
+            "subspecialties": ["maternal_fetal"],
+            "insurances": ["aetna", "uhc", "bcbs", "cigna"],
+            "schedule": {
+                "Mon": ["09:00", "10:00", "11:00", "14:00"],
+                "Tue": ["09:00", "14:00", "15:00"]
+            }
+        },
+        {
+            "name": "Dr. Emily Johnson",
+            "subspecialties": ["gynecologic_oncology"],
+            "insurances": ["aetna", "bcbs", "medicare"],
+            "schedule": {
+                "Wed": ["09:00", "10:00", "14:00"],
+                "Thu": ["09:00", "10:00", "11:00", "14:00"]
+            }
+        },
+        {
+            "name": "Dr. Frank Garcia",
+            "subspecialties": ["reproductive_endo"],
+            "insurances": ["uhc", "cigna"],
+            "schedule": {
+                "Wed": ["10:00", "11:00", "15:00", "16:00"]
+            }
+        },
+        {
+            "name": "Dr. Grace Wong",
+            "subspecialties": ["general_obgyn", "minimally_invasive"],
+            "insurances": ["aetna", "bcbs"],
+            "schedule": {
+                "Thu": ["10:00", "11:00", "14:00", "15:00"]
+            }
+        },
+        {
+            "name": "Dr. Hannah Kim",
+            "subspecialties": ["general_obgyn", "maternal_fetal"],
+            "insurances": ["aetna", "uhc", "bcbs", "medicare"],
+            "schedule": {
+                "Sat": ["09:00", "10:00", "11:00"]
+            }
+        },
+        {
+            "name": "Dr. Kevin Miller",
+            "subspecialties": ["general_obgyn"],
+            "insurances": ["uhc", "cigna", "bcbs"],
+            "schedule": {
+                "Mon": ["14:00", "15:00", "16:00"],
+                "Fri": ["09:00", "10:00", "14:00"]
+            }
+        },
+        {
+            "name": "Dr. Linda Lopez",
+            "subspecialties": ["urogynecology"],
+            "insurances": ["aetna", "medicare"],
+            "schedule": {
+                "Sat": ["09:00", "10:00"]
+            }
+        },
+        {
+            "name": "Dr. Michael Zhang",
+            "subspecialties": ["general_obgyn", "reproductive_endo"],
+            "insurances": ["aetna", "uhc", "cigna"],
+            "schedule": {
+                "Tue": ["14:00", "15:00", "16:00"]
+            }
+        }
+    ]
+}
+
+
 def get_default_doctors() -> Dict[str, Any]:
     """
     Returns default mock doctor data with 11 OB/GYN specialists.
     This data is used when no Excel file is uploaded.
+    The same module-level object is returned on every call; treat it as read-only.
     """
-    return {
-        "doctors": [
-            {
-                "name": "Dr. Alice Smith",
-                "subspecialties": ["general_obgyn", "maternal_fetal"],
-                "insurances": ["aetna", "uhc", "bcbs"],
-                "schedule": {
-                    "Mon": ["09:00", "10:00", "14:00", "15:00"],
-                    "Tue": ["09:00", "10:00", "11:00"],
-                    "Thu": ["09:00", "14:00", "15:00", "16:00"]
-                }
-            },
-            {
-                "name": "Dr. Brian Lee",
-                "subspecialties": ["general_obgyn", "minimally_invasive"],
-                "insurances": ["aetna", "cigna"],
-                "schedule": {
-                    "Tue": ["10:00", "11:00", "14:00"],
-                    "Wed": ["09:00", "10:00", "14:00", "15:00"],
-                    "Fri": ["09:00", "10:00", "11:00"]
-                }
-            },
-            {
-                "name": "Dr. Carol Chen",
-                "subspecialties": ["general_obgyn", "urogynecology"],
-                "insurances": ["aetna", "uhc", "medicare"],
-                "schedule": {
-                    "Mon": ["10:00", "11:00", "15:00"],
-                    "Wed": ["09:00", "14:00", "15:00", "16:00"],
-                    "Fri": ["09:00", "10:00", "14:00"]
-                }
-            },
-            {
-                "name": "Dr. David Patel",
-                "subspecialties": ["maternal_fetal"],
-                "insurances": ["aetna", "uhc", "bcbs", "cigna"],
-                "schedule": {
-                    "Mon": ["09:00", "10:00", "11:00", "14:00"],
-                    "Tue": ["09:00", "14:00", "15:00"]
-                }
-            },
-            {
-                "name": "Dr. Emily Johnson",
-                "subspecialties": ["gynecologic_oncology"],
-                "insurances": ["aetna", "bcbs", "medicare"],
-                "schedule": {
-                    "Wed": ["09:00", "10:00", "14:00"],
-                    "Thu": ["09:00", "10:00", "11:00", "14:00"]
-                }
-            },
-            {
-                "name": "Dr. Frank Garcia",
-                "subspecialties": ["reproductive_endo"],
-                "insurances": ["uhc", "cigna"],
-                "schedule": {
-                    "Wed": ["10:00", "11:00", "15:00", "16:00"]
-                }
-            },
-            {
-                "name": "Dr. Grace Wong",
-                "subspecialties": ["general_obgyn", "minimally_invasive"],
-                "insurances": ["aetna", "bcbs"],
-                "schedule": {
-                    "Thu": ["10:00", "11:00", "14:00", "15:00"]
-                }
-            },
-            {
-                "name": "Dr. Hannah Kim",
-                "subspecialties": ["general_obgyn", "maternal_fetal"],
-                "insurances": ["aetna", "uhc", "bcbs", "medicare"],
-                "schedule": {
-                    "Sat": ["09:00", "10:00", "11:00"]
-                }
-            },
-            {
-                "name": "Dr. Kevin Miller",
-                "subspecialties": ["general_obgyn"],
-                "insurances": ["uhc", "cigna", "bcbs"],
-                "schedule": {
-                    "Mon": ["14:00", "15:00", "16:00"],
-                    "Fri": ["09:00", "10:00", "14:00"]
-                }
-            },
-            {
-                "name": "Dr. Linda Lopez",
-                "subspecialties": ["urogynecology"],
-                "insurances": ["aetna", "medicare"],
-                "schedule": {
-                    "Sat": ["09:00", "10:00"]
-                }
-            },
-            {
-                "name": "Dr. Michael Zhang",
-                "subspecialties": ["general_obgyn", "reproductive_endo"],
-                "insurances": ["aetna", "uhc", "cigna"],
-                "schedule": {
-                    "Tue": ["14:00", "15:00", "16:00"]
-                }
-            }
-        ]
-    }
+    return _DEFAULT_DOCTORS
 
 
 def load_schedule(xlsx_path: Optional[str] = None) -> Dict[str, Any]: